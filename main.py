@@ -5,109 +5,366 @@ import tempfile
 import zipfile
 import shutil
 import json
+import hashlib
+import functools
+import ast
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from typing import List # ⭐️ 新增：导入 List
 from fastapi import FastAPI, File, UploadFile, HTTPException, status
 from fastapi.responses import JSONResponse, HTMLResponse
 from fastapi.concurrency import run_in_threadpool
+from fastapi.middleware.gzip import GZipMiddleware
+import anyio
+import httpx
 from google import genai
+from google.genai import errors as genai_errors
+from google.genai import types as genai_types
 import markdown2
+import jinja2
 from starlette.responses import FileResponse
 
 os.environ["OBJC_DISABLE_INITIALIZE_FORK_SAFETY"] = "YES"
 app = FastAPI(title="Code Review Agent", description="基于 Gemini 模型的智能代码审查系统", version="1.0")
+# 超过 1KB 的响应（如 HTML 报告、批量 JSON 结果）启用 gzip 压缩
+app.add_middleware(GZipMiddleware, minimum_size=1024)
 
 GEMINI_API_KEY = os.getenv("GENAI_API_KEY")
 if not GEMINI_API_KEY:
     raise ValueError("请先在系统环境中设置 GENAI_API_KEY")
+# 所有并发审查共用一个长连接池（HTTP/2 多路复用），省去每次调用的 TCP/TLS 握手
+gemini_http_client = httpx.AsyncClient(
+    http2=True,
+    timeout=None, # 超时由 SDK 按请求控制，审查耗时可能较长
+    limits=httpx.Limits(max_keepalive_connections=64, max_connections=128),
+)
 try:
-    client = genai.Client(api_key=GEMINI_API_KEY)
+    client = genai.Client(
+        api_key=GEMINI_API_KEY,
+        http_options=genai_types.HttpOptions(httpx_async_client=gemini_http_client)
+    )
     MODEL_NAME = "gemini-2.5-pro"
 except Exception as e:
     print(f"初始化 Gemini 客户端失败: {e}")
     raise
 
-async def get_review_data(filename: str, content: bytes) -> dict:
+UPLOAD_CHUNK_SIZE = 1 << 20 # 1MB
+
+# 限制并发的 Gemini 调用数与静态检查子进程数，避免触发配额限制 (429) 或拖垮机器
+GEMINI_SEM = asyncio.Semaphore(int(os.getenv("GEMINI_CONCURRENCY", "8")))
+STATIC_SEM = asyncio.Semaphore(2 * (os.cpu_count() or 1))
+GEMINI_MAX_RETRIES = 3
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# 以 (模型, 提示词模板版本, 完整提示词) 的哈希为键缓存 Gemini 审查结果，相同内容无需重复调用
+PROMPT_VERSION = "1"
+REVIEW_CACHE_SIZE = int(os.getenv("REVIEW_CACHE_SIZE", "1024"))
+_review_cache: "OrderedDict[str, str]" = OrderedDict()
+
+# 小文件合并为一次 Gemini 调用，摊薄单次请求开销
+SMALL_FILE_BYTES = 8 * 1024
+BATCH_MAX_CHARS = 30_000
+
+# ZIP 内同语言文件一次性交给 linter，超时按整批计算
+BATCH_STATIC_TIMEOUT = 120.0
+
+# Python 静态检查默认使用 ruff（启动快），设置 PY_LINTER=pylint 可切回 pylint
+PY_LINTER = os.getenv("PY_LINTER", "ruff").lower()
+if PY_LINTER not in ("ruff", "pylint"):
+    raise ValueError(f"PY_LINTER 只支持 ruff 或 pylint，当前为: {PY_LINTER}")
+
+# 超过该长度的文件分片审查，控制单次调用的 token 数
+MAX_PROMPT_CHARS = 60_000
+CHUNK_OVERLAP_LINES = 10
+
+LANGUAGE_MAP = {".py": "Python", ".swift": "Swift", ".c": "C", ".cpp": "C++", ".js": "JavaScript", ".java": "Java"}
+
+THREAD_POOL_SIZE = int(os.getenv("THREAD_POOL_SIZE", "128"))
+
+# 请求体大小上限，以及 ZIP 解压后总大小上限（防御 zip bomb）
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(50 * 1024 * 1024)))
+MAX_ZIP_UNCOMPRESSED_BYTES = int(os.getenv("MAX_ZIP_UNCOMPRESSED_BYTES", str(200 * 1024 * 1024)))
+
+def _upload_too_large_detail() -> str:
+    return f"上传内容过大（超过 {MAX_UPLOAD_BYTES // (1024 * 1024)}MB）。"
+
+class UploadSizeLimitMiddleware:
+    """
+    ASGI 中间件：Content-Length 超限时直接返回 413；对分块上传等未声明长度的请求，
+    在 receive 中边接收边累计字节数，一旦超过 MAX_UPLOAD_BYTES 立即中止并返回 413，
+    请求体不会被完整缓冲。
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        content_length = dict(scope["headers"]).get(b"content-length", b"")
+        if content_length.isdigit() and int(content_length) > MAX_UPLOAD_BYTES:
+            response = JSONResponse(
+                {"detail": _upload_too_large_detail()},
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+            )
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > MAX_UPLOAD_BYTES:
+                    # 请求体解析过程中抛出的 HTTPException 会被 FastAPI 原样转为 413 响应
+                    raise HTTPException(
+                        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                        detail=_upload_too_large_detail()
+                    )
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+app.add_middleware(UploadSizeLimitMiddleware)
+
+@app.on_event("startup")
+async def configure_thread_pools():
+    """
+    启动时放宽线程池上限：anyio 默认仅 40 个 token，事件循环默认执行器为 min(32, cpu+4)，
+    ZIP 内文件较多时阻塞型任务（读文件、解压等）会排队。
+    """
+    anyio.to_thread.current_default_thread_limiter().total_tokens = THREAD_POOL_SIZE
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=THREAD_POOL_SIZE))
+
+@app.on_event("shutdown")
+async def close_gemini_http_client():
+    await gemini_http_client.aclose()
+
+def _save_upload_to_disk(file: UploadFile, dest_path: str) -> None:
+    """
+    将上传文件按固定大小分块复制到磁盘（同步函数，需在线程池中调用）。
+    """
+    file.file.seek(0)
+    with open(dest_path, "wb") as f:
+        shutil.copyfileobj(file.file, f, length=UPLOAD_CHUNK_SIZE)
+
+async def get_review_data(filename: str, content: bytes, review_md: str | None = None, run_static: bool = True) -> dict:
     """
     执行审查的核心逻辑，接收文件名和字节内容。
+    若已通过批量审查拿到 review_md，则跳过单独的 Gemini 调用；
+    run_static 为 False 时不做静态检查（static_check 为 None），由调用方批量执行。
     """
     ext = os.path.splitext(filename)[1].lower()
-    language_map = {".py": "Python", ".swift": "Swift", ".c": "C", ".cpp": "C++", ".js": "JavaScript", ".java": "Java"}
-    language = language_map.get(ext, "Unknown")
+    language = LANGUAGE_MAP.get(ext, "Unknown")
     
-    tmp_path = ""
     try:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=ext) as tmp:
-            tmp.write(content)
-            tmp_path = tmp.name
+        code_text = content.decode("utf-8", errors="strict")
+    except UnicodeDecodeError:
+        return {
+            "filename": filename,
+            "language": language,
+            "static_check": "N/A",
+            "gemini_review_markdown": "⚠️ 编码错误：文件编码不是有效的 UTF-8，无法审查。",
+        }
 
+    suggestion_md = review_md or ""
+    if review_md is None:
         try:
-            code_text = content.decode("utf-8", errors="strict")
-        except UnicodeDecodeError:
-            return {
-                "filename": filename,
-                "language": language,
-                "static_check": "N/A",
-                "gemini_review_markdown": "⚠️ 编码错误：文件编码不是有效的 UTF-8，无法审查。",
-            }
+            if len(code_text) <= MAX_PROMPT_CHARS:
+                suggestion_md = await generate_review(_build_prompt(language, code_text))
+            else:
+                suggestion_md = await _review_in_chunks(language, ext, code_text)
+        except Exception as e:
+            suggestion_md = f"⚠️ 调用 Gemini 模型时出错: {str(e)}"
 
-        prompt = f"""
-你是一位资深软件工程师，请对以下 {language} 代码进行专业 code review：
+    static_check = None
+    if run_static:
+        async with STATIC_SEM:
+            static_check = await run_static_analysis(content, filename, ext)
+
+    return {
+        "filename": filename,
+        "language": language,
+        "static_check": static_check,
+        "gemini_review_markdown": suggestion_md,
+    }
+
+def _build_prompt(language: str, code_text: str, scope: str = "") -> str:
+    return f"""
+你是一位资深软件工程师，请对以下 {language} 代码{scope}进行专业 code review：
 - 找出潜在 bug、安全问题和性能问题；
 - 给出修改建议；
 - 尝试直接提供修改后的代码（只输出修改后的完整代码）；
 --------------------
 {code_text}
 """
-        suggestion_md = ""
+
+def _window_ranges(lines: list[str], begin: int, end: int) -> list[tuple[int, int]]:
+    """
+    将 lines[begin:end] 按字符数切成若干窗口，相邻窗口最多重叠 CHUNK_OVERLAP_LINES 行。
+    """
+    ranges = []
+    start = begin
+    while start < end:
+        size = 0
+        stop = start
+        while stop < end and (stop == start or size + len(lines[stop]) <= MAX_PROMPT_CHARS):
+            size += len(lines[stop])
+            stop += 1
+        ranges.append((start, stop))
+        if stop >= end:
+            break
+        # 重叠行数不超过窗口的一半，保证每个窗口都实质性前移
+        start = stop - min(CHUNK_OVERLAP_LINES, (stop - start) // 2)
+    return ranges
+
+def _split_code(lines: list[str], code_text: str, ext: str) -> list[tuple[int, int]]:
+    """
+    将大文件切分为若干行区间 [start, end)：Python 按顶层定义切分并合并到
+    MAX_PROMPT_CHARS 以内，其他语言（或解析失败时）按固定窗口切分。
+    """
+    boundaries = []
+    if ext == ".py":
         try:
-            response = await run_in_threadpool(
-                client.models.generate_content,
-                model=MODEL_NAME,
-                contents=prompt
-            )
-            suggestion_md = response.text
-        except Exception as e:
-            suggestion_md = f"⚠️ 调用 Gemini 模型时出错: {str(e)}"
+            for node in ast.parse(code_text).body:
+                decorators = getattr(node, "decorator_list", [])
+                boundaries.append(min([node.lineno] + [d.lineno for d in decorators]) - 1)
+        except (SyntaxError, ValueError):
+            boundaries = []
+    if not boundaries:
+        return _window_ranges(lines, 0, len(lines))
 
-        static_check = await run_static_analysis(tmp_path, ext)
+    boundaries = sorted(set([0] + boundaries + [len(lines)]))
+    ranges = []
+    current = None # (start, end, size)
+    for seg_start, seg_end in zip(boundaries, boundaries[1:]):
+        seg_size = sum(len(line) for line in lines[seg_start:seg_end])
+        if seg_size > MAX_PROMPT_CHARS:
+            if current:
+                ranges.append(current[:2])
+                current = None
+            ranges.extend(_window_ranges(lines, seg_start, seg_end))
+        elif current and current[2] + seg_size <= MAX_PROMPT_CHARS:
+            current = (current[0], seg_end, current[2] + seg_size)
+        else:
+            if current:
+                ranges.append(current[:2])
+            current = (seg_start, seg_end, seg_size)
+    if current:
+        ranges.append(current[:2])
+    return ranges
 
-        return {
-            "filename": filename,
-            "language": language,
-            "static_check": static_check,
-            "gemini_review_markdown": suggestion_md,
-        }
+async def _review_in_chunks(language: str, ext: str, code_text: str) -> str:
+    """
+    大文件分片并发审查，再按行号拼接各片段的审查意见。
+    每个片段单独命中缓存，未改动的片段无需重新调用。
+    """
+    lines = code_text.splitlines(keepends=True)
+    # ast.parse 处理大文件可能耗时数秒，放入线程池避免阻塞事件循环
+    ranges = await run_in_threadpool(_split_code, lines, code_text, ext)
+    # 提示词中不带行号，文件其他位置增删行时未改动片段的缓存键保持不变
+    reviews = await asyncio.gather(*(
+        generate_review(_build_prompt(language, "".join(lines[start:end]), "（此为一个较大文件中的片段）"))
+        for start, end in ranges
+    ))
+    return "\n\n".join(
+        f"## 第 {start + 1}-{end} 行\n\n{review}"
+        for (start, end), review in zip(ranges, reviews)
+    )
 
-    finally:
-        if tmp_path and os.path.exists(tmp_path):
-            os.unlink(tmp_path)
+def _review_cache_key(prompt: str, config: genai_types.GenerateContentConfig | None = None) -> str:
+    config_key = config.model_dump_json(exclude_none=True) if config is not None else ""
+    hasher = hashlib.blake2b(digest_size=16)
+    for part in (MODEL_NAME, PROMPT_VERSION, config_key, prompt):
+        hasher.update(part.encode("utf-8"))
+        hasher.update(b"\0")
+    return hasher.hexdigest()
 
-async def run_static_analysis(tmp_path: str, ext: str) -> str:
+def _review_cache_get(key: str) -> str | None:
+    cached = _review_cache.get(key)
+    if cached is not None:
+        _review_cache.move_to_end(key)
+    return cached
+
+def _review_cache_put(key: str, text: str) -> None:
+    _review_cache[key] = text
+    if len(_review_cache) > REVIEW_CACHE_SIZE:
+        _review_cache.popitem(last=False)
+
+async def generate_review(prompt: str, config: genai_types.GenerateContentConfig | None = None) -> str:
+    """
+    在并发上限内调用 Gemini，遇到 429/5xx 时按指数退避重试；结果按内容哈希缓存。
+    config（如 JSON 输出模式）会计入缓存键。
     """
-    异步运行静态分析工具。
+    key = _review_cache_key(prompt, config)
+    cached = _review_cache_get(key)
+    if cached is not None:
+        return cached
+
+    delay = 1.0
+    for attempt in range(GEMINI_MAX_RETRIES + 1):
+        try:
+            async with GEMINI_SEM:
+                response = await client.aio.models.generate_content(
+                    model=MODEL_NAME,
+                    contents=prompt,
+                    config=config
+                )
+            text = response.text
+            _review_cache_put(key, text)
+            return text
+        except genai_errors.APIError as e:
+            if e.code not in RETRYABLE_STATUS_CODES or attempt == GEMINI_MAX_RETRIES:
+                raise
+        # 退避等待时释放信号量，让其他请求继续
+        await asyncio.sleep(delay)
+        delay *= 2
+
+async def run_static_analysis(content: bytes, filename: str, ext: str) -> str:
+    """
+    异步运行静态分析工具。源码通过 stdin 传入，无需落盘；
+    仅 swiftlint 需要真实路径，此时才写临时文件。
     """
     command = []
-    if ext == ".py":
-        command = ["pylint", tmp_path, "--score=n"]
+    tmp_path = ""
+    # 加 ./ 前缀，防止以 - 开头的文件名被当作选项解析
+    stdin_filename = _as_cli_paths([os.path.basename(filename)])[0]
+    if ext == ".py" and PY_LINTER == "pylint":
+        command = ["pylint", "--score=n", "--from-stdin", stdin_filename]
+    elif ext == ".py":
+        command = ["ruff", "check", "--output-format=concise", "--no-cache", f"--stdin-filename={stdin_filename}", "-"]
     elif ext == ".swift":
+        with tempfile.NamedTemporaryFile(delete=False, suffix=ext) as tmp:
+            tmp.write(content)
+            tmp_path = tmp.name
         command = ["swiftlint", "lint", "--path", tmp_path]
     elif ext in [".c", ".cpp"]:
-        command = ["clang", "-fsyntax-only", tmp_path]
+        command = ["clang", "-fsyntax-only", "-x", "c" if ext == ".c" else "c++", "-"]
     else:
         return "N/A (静态检查未对此语言配置)"
     try:
         process = await asyncio.create_subprocess_exec(
             *command,
+            stdin=None if tmp_path else asyncio.subprocess.PIPE,
             stdout=asyncio.subprocess.PIPE,
             stderr=asyncio.subprocess.PIPE
         )
-        stdout_bytes, stderr_bytes = await asyncio.wait_for(process.communicate(), timeout=20.0)
+        stdin_data = None if tmp_path else content
+        stdout_bytes, stderr_bytes = await asyncio.wait_for(process.communicate(stdin_data), timeout=20.0)
         stdout = stdout_bytes.decode("utf-8", errors="ignore")
         stderr = stderr_bytes.decode("utf-8", errors="ignore")
         if ext in [".c", ".cpp"]:
             return stderr if stderr else "[Clang] 未发现语法错误。"
+        elif stdout:
+            return stdout
+        elif process.returncode != 0:
+            # 无输出但退出码非零，说明 linter 本身运行失败，不能报告为"未发现问题"
+            return f"[错误] 静态检查工具 '{command[0]}' 运行失败 (退出码 {process.returncode}):\n{stderr}"
         else:
-            return stdout if stdout else "[Linter] 未发现问题。"
+            return "[Linter] 未发现问题。"
     except asyncio.TimeoutError:
         try:
             process.terminate()
@@ -119,6 +376,308 @@ async def run_static_analysis(tmp_path: str, ext: str) -> str:
         return f"[错误] 静态检查工具 '{command[0]}' 未安装或不在系统 PATH 中。"
     except Exception as e:
         return f"静态检查时发生意外错误: {str(e)}"
+    finally:
+        if tmp_path and os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+
+def _pack_batches(files: list[tuple[str, bytes]]) -> list[list[tuple[str, bytes]]]:
+    """
+    按内容长度贪心装箱，每个批次总长度不超过 BATCH_MAX_CHARS。
+    """
+    batches = []
+    current = []
+    current_size = 0
+    for name, content in files:
+        if current and current_size + len(content) > BATCH_MAX_CHARS:
+            batches.append(current)
+            current = []
+            current_size = 0
+        current.append((name, content))
+        current_size += len(content)
+    if current:
+        batches.append(current)
+    return batches
+
+def _parse_batch_reviews(raw: str) -> dict:
+    """
+    解析批量审查返回的 JSON 数组，返回 {filename: review} 映射。
+    """
+    text = raw.strip()
+    if text.startswith("```"):
+        text = text.split("\n", 1)[1] if "\n" in text else ""
+        text = text.rsplit("```", 1)[0]
+    items = json.loads(text)
+    return {
+        item["filename"]: item["review"]
+        for item in items
+        if isinstance(item, dict) and isinstance(item.get("filename"), str) and isinstance(item.get("review"), str)
+    }
+
+# 批量审查要求模型以 JSON 模式输出，保证结果可解析
+BATCH_REVIEW_CONFIG = genai_types.GenerateContentConfig(response_mime_type="application/json")
+
+async def review_batch(files: list[tuple[str, bytes]]) -> list[dict]:
+    """
+    将多个小文件合并到一个提示词中审查，再按文件名拆分结果。
+    每个文件先按单文件提示词查缓存，只把未命中的文件放入批次；批量结果也按单文件键写回缓存，
+    这样批次中某个文件改动时，其余文件无需重新审查。
+    解析失败或缺失的文件回退为单独审查。
+    """
+    reviews = {}
+    single_keys = {}
+    sections = []
+    for name, content in files:
+        try:
+            code_text = content.decode("utf-8", errors="strict")
+        except UnicodeDecodeError:
+            continue # 编码错误交由 get_review_data 处理
+        language = LANGUAGE_MAP.get(os.path.splitext(name)[1].lower(), "Unknown")
+        key = _review_cache_key(_build_prompt(language, code_text))
+        cached = _review_cache_get(key)
+        if cached is not None:
+            reviews[name] = cached
+            continue
+        single_keys[name] = key
+        sections.append(f"===FILE: {name} ({language})===\n{code_text}")
+
+    # 只剩一个未命中的文件时直接走单文件审查，无需批量提示词
+    if len(sections) > 1:
+        joined_sections = "\n".join(sections)
+        prompt = f"""
+你是一位资深软件工程师，下面有 {len(sections)} 个文件，以 `===FILE: <文件名> (<语言>)===` 分隔，请分别进行专业 code review：
+- 找出潜在 bug、安全问题和性能问题；
+- 给出修改建议；
+请只返回一个 JSON 数组，不要输出其他内容，每个元素形如 {{"filename": "<文件名>", "review": "<Markdown 格式的审查意见>"}}。
+--------------------
+{joined_sections}
+"""
+        try:
+            batch_reviews = _parse_batch_reviews(await generate_review(prompt, config=BATCH_REVIEW_CONFIG))
+        except Exception:
+            batch_reviews = {}
+        for name, review in batch_reviews.items():
+            if name in single_keys:
+                reviews[name] = review
+                _review_cache_put(single_keys[name], review)
+
+    return await asyncio.gather(*(
+        get_review_data(name, content, reviews.get(name), run_static=False) for name, content in files
+    ))
+
+async def _review_small_files(files: list[tuple[str, bytes]]) -> list[dict]:
+    """
+    将小文件按批次审查；单文件批次直接走普通审查流程。
+    """
+    batches = _pack_batches(files)
+    batch_results = await asyncio.gather(*(
+        review_batch(batch) if len(batch) > 1 else get_review_data(*batch[0], run_static=False)
+        for batch in batches
+    ))
+    results = []
+    for res in batch_results:
+        if isinstance(res, list):
+            results.extend(res)
+        else:
+            results.append(res)
+    return results
+
+def _route_linter_output(output: str, path_to_name: dict) -> dict:
+    """
+    将多文件 linter 的文本输出按行首路径分配到对应文件，
+    不带路径的续行（代码片段、^ 标记等）归属上一个文件。
+    """
+    routed = {}
+    current = None
+    for line in output.splitlines():
+        for path, name in path_to_name.items():
+            if line.startswith(path + ":"):
+                current = name
+                break
+        if current is not None:
+            routed.setdefault(current, []).append(line)
+    return {name: "\n".join(lines) for name, lines in routed.items()}
+
+async def _exec_batch_linter(command: list[str], cwd: str, require_stdout: bool = False) -> tuple[str, str]:
+    """
+    在 cwd 下运行一次多文件 linter，返回 (stdout, stderr)。
+    require_stdout 为 True 时（JSON 输出的 linter），无输出且退出码非零视为运行失败并抛出异常。
+    """
+    process = await asyncio.create_subprocess_exec(
+        *command,
+        cwd=cwd,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE
+    )
+    try:
+        stdout_bytes, stderr_bytes = await asyncio.wait_for(process.communicate(), timeout=BATCH_STATIC_TIMEOUT)
+    except asyncio.TimeoutError:
+        try:
+            process.terminate()
+            await process.wait()
+        except ProcessLookupError:
+            pass
+        raise
+    stdout = stdout_bytes.decode("utf-8", errors="ignore")
+    stderr = stderr_bytes.decode("utf-8", errors="ignore")
+    if require_stdout and not stdout.strip() and process.returncode != 0:
+        raise RuntimeError(f"'{command[0]}' 运行失败 (退出码 {process.returncode}):\n{stderr}")
+    return stdout, stderr
+
+def _as_cli_paths(names: list[str]) -> list[str]:
+    """
+    为文件路径加上 ./ 前缀，防止以 - 或 @ 开头的 ZIP 条目名被 linter 当作选项或响应文件解析。
+    """
+    return [os.path.join(".", name) for name in names]
+
+async def _batch_pylint(root: str, names: list[str]) -> dict:
+    stdout, _ = await _exec_batch_linter(
+        ["pylint", "--jobs=0", "--output-format=json", "--score=n", *_as_cli_paths(names)], root, require_stdout=True
+    )
+    by_path = {os.path.normpath(name): name for name in names}
+    routed = {}
+    for msg in json.loads(stdout or "[]"):
+        name = by_path.get(os.path.normpath(msg.get("path", "")))
+        if name is None:
+            continue
+        routed.setdefault(name, []).append(
+            f"{msg['path']}:{msg['line']}:{msg['column']}: {msg['message-id']}: {msg['message']} ({msg['symbol']})"
+        )
+    return {name: "\n".join(routed[name]) if name in routed else "[Linter] 未发现问题。" for name in names}
+
+async def _batch_ruff(root: str, names: list[str]) -> dict:
+    stdout, _ = await _exec_batch_linter(
+        ["ruff", "check", "--output-format=json", "--no-cache", *_as_cli_paths(names)], root, require_stdout=True
+    )
+    by_path = {os.path.realpath(os.path.join(root, name)): name for name in names}
+    routed = {}
+    for msg in json.loads(stdout or "[]"):
+        name = by_path.get(os.path.realpath(os.path.join(root, msg.get("filename", ""))))
+        if name is None:
+            continue
+        location = msg.get("location") or {}
+        routed.setdefault(name, []).append(
+            f"{name}:{location.get('row')}:{location.get('column')}: {msg.get('code')} {msg.get('message')}"
+        )
+    return {name: "\n".join(routed[name]) if name in routed else "[Linter] 未发现问题。" for name in names}
+
+async def _batch_clang(root: str, names: list[str]) -> dict:
+    _, stderr = await _exec_batch_linter(["clang", "-fsyntax-only", *_as_cli_paths(names)], root)
+    routed = _route_linter_output(stderr, {cli_path: name for cli_path, name in zip(_as_cli_paths(names), names)})
+    return {name: routed.get(name, "[Clang] 未发现语法错误。") for name in names}
+
+async def _batch_swiftlint(root: str, names: list[str]) -> dict:
+    stdout, _ = await _exec_batch_linter(["swiftlint", "lint", "--quiet", *_as_cli_paths(names)], root)
+    path_to_name = {}
+    for cli_path, name in zip(_as_cli_paths(names), names):
+        path_to_name[cli_path] = name
+        path_to_name[name] = name
+        path_to_name[os.path.join(root, name)] = name
+        path_to_name[os.path.realpath(os.path.join(root, name))] = name
+    routed = _route_linter_output(stdout, path_to_name)
+    return {name: routed.get(name, "[Linter] 未发现问题。") for name in names}
+
+BATCH_LINTERS = {
+    PY_LINTER: ((".py",), _batch_pylint if PY_LINTER == "pylint" else _batch_ruff),
+    "swiftlint": ((".swift",), _batch_swiftlint),
+    "clang": ((".c", ".cpp"), _batch_clang),
+}
+
+async def run_batch_static_analysis(root: str, names: list[str]) -> dict:
+    """
+    按语言分组，每种 linter 只启动一次子进程检查 root 下的全部文件，
+    返回 {相对路径: 静态检查结果}。
+    """
+    async def _run(tool: str, runner, group: list[str]) -> dict:
+        try:
+            async with STATIC_SEM:
+                return await runner(root, group)
+        except asyncio.TimeoutError:
+            message = f"静态检查超时 (超过 {BATCH_STATIC_TIMEOUT:.0f} 秒)。"
+        except FileNotFoundError:
+            message = f"[错误] 静态检查工具 '{tool}' 未安装或不在系统 PATH 中。"
+        except Exception as e:
+            message = f"静态检查时发生意外错误: {str(e)}"
+        return {name: message for name in group}
+
+    jobs = []
+    for tool, (exts, runner) in BATCH_LINTERS.items():
+        group = [name for name in names if os.path.splitext(name)[1].lower() in exts]
+        if group:
+            jobs.append(_run(tool, runner, group))
+
+    static_checks = {name: "N/A (静态检查未对此语言配置)" for name in names}
+    for routed in await asyncio.gather(*jobs):
+        static_checks.update(routed)
+    return static_checks
+
+def _read_zip_entries(zip_path: str) -> tuple[list[tuple[str, bytes]], list[str]]:
+    """
+    按 infolist 逐项读取 ZIP，只解压需要审查的条目到内存（同步函数，需在线程池中调用）。
+    返回 (待审查的 (路径, 内容) 列表, 过大而跳过的文件名列表)。
+    """
+    entries = []
+    oversized = []
+    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+        infos = zip_ref.infolist()
+        if sum(info.file_size for info in infos) > MAX_ZIP_UNCOMPRESSED_BYTES:
+            raise HTTPException(
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                detail=f"ZIP 解压后总大小超过 {MAX_ZIP_UNCOMPRESSED_BYTES // (1024 * 1024)}MB，已拒绝。"
+            )
+        for info in infos:
+            if info.is_dir():
+                continue
+            basename = os.path.basename(info.filename)
+            if basename.startswith('.') or basename.endswith(('.DS_Store', 'LICENSE', 'README.md')):
+                continue
+            if info.file_size > 5 * 1024 * 1024: # 5MB
+                oversized.append(basename)
+                continue
+            entries.append((info.filename, zip_ref.read(info)))
+    return entries, oversized
+
+def _write_lint_tree(root: str, entries: list[tuple[str, bytes]]) -> tuple[dict, dict]:
+    """
+    仅将批量 linter 支持的文件写入 root 目录（同步函数，需在线程池中调用），
+    返回 ({root 下的相对路径: ZIP 内路径}, {写入失败的 ZIP 内路径: 错误信息})。
+    清理后路径重复（如 a.py 与 ./a.py）或与已有文件/目录冲突（如 x.py 与 x.py/y.py）的条目
+    放到独立的子目录中；单个条目写入失败不影响其他文件。
+    """
+    lint_exts = {ext for exts, _ in BATCH_LINTERS.values() for ext in exts}
+    rel_to_name = {}
+    failed = {}
+    created_dirs = set() # 同一目录只调用一次 makedirs，减少重复的 stat/mkdir 系统调用
+
+    def _write(rel_path: str, content: bytes) -> None:
+        full_path = os.path.join(root, rel_path)
+        parent_dir = os.path.dirname(full_path)
+        if parent_dir not in created_dirs:
+            os.makedirs(parent_dir, exist_ok=True)
+            created_dirs.add(parent_dir)
+        with open(full_path, "xb") as f:
+            f.write(content)
+
+    for name, content in entries:
+        if os.path.splitext(name)[1].lower() not in lint_exts:
+            continue
+        # 去掉绝对路径与 .. 等成分，防止写出 root 之外
+        parts = [part for part in name.replace("\\", "/").split("/") if part not in ("", ".", "..")]
+        if not parts:
+            continue
+        rel_path = os.path.join(*parts)
+        try:
+            try:
+                if rel_path in rel_to_name:
+                    raise FileExistsError(rel_path)
+                _write(rel_path, content)
+            except OSError:
+                rel_path = os.path.join(os.path.relpath(tempfile.mkdtemp(dir=root), root), rel_path)
+                _write(rel_path, content)
+        except OSError as e:
+            failed[name] = f"[错误] 无法为静态检查准备该文件: {str(e)}"
+            continue
+        rel_to_name[rel_path] = name
+    return rel_to_name, failed
 
 @app.post("/review", summary="获取单个文件的 JSON 审查结果")
 async def review_code_json(file: UploadFile = File(...)):
@@ -150,12 +709,11 @@ async def review_multiple_files(files: List[UploadFile] = File(...)): # 接收 L
             detail="请至少上传一个文件。"
         )
 
-    tasks = []
-    for file in files:
-        content = await file.read()
-        tasks.append(get_review_data(file.filename, content))
-    
-    results = await asyncio.gather(*tasks)
+    async def _read_and_review(f: UploadFile) -> dict:
+        return await get_review_data(f.filename, await f.read())
+
+    # 读取与审查并发进行，无需等待所有文件读取完毕
+    results = await asyncio.gather(*(_read_and_review(f) for f in files))
 
     formatted_results = []
     for res in results:
@@ -165,10 +723,9 @@ async def review_multiple_files(files: List[UploadFile] = File(...)): # 接收 L
     return JSONResponse({"results": formatted_results})
 
 
-@app.post("/review/zip", summary="获取 ZIP 压缩包内所有文件的 JSON 审查结果")
-async def review_zip(file: UploadFile = File(...)):
+async def _review_zip_impl(file: UploadFile) -> list[dict]:
     """
-    上传 ZIP 文件，返回包内所有代码文件的审查报告列表。
+    ZIP 审查流程，返回审查结果字典列表，供 JSON 与 HTML 两个接口共用。
     """
     if not file.filename.lower().endswith('.zip'):
         raise HTTPException(
@@ -177,44 +734,68 @@ async def review_zip(file: UploadFile = File(...)):
         )
 
     tmp_zip_path = ""
-    tmp_extract_dir = ""
+    tmp_lint_dir = ""
     results = []
     
     try:
-        tmp_zip_path = os.path.join(tempfile.gettempdir(), file.filename)
-        content = await file.read()
-        with open(tmp_zip_path, "wb") as f:
-            f.write(content)
+        # 使用唯一的临时文件名，避免同名并发上传互相覆盖，以及文件名中的 ../ 写出临时目录
+        fd, tmp_zip_path = tempfile.mkstemp(suffix=".zip")
+        os.close(fd)
+        # 分块流式写入磁盘，避免将整个 ZIP 读入内存
+        await run_in_threadpool(_save_upload_to_disk, file, tmp_zip_path)
 
-        tmp_extract_dir = tempfile.mkdtemp()
-        with zipfile.ZipFile(tmp_zip_path, 'r') as zip_ref:
-            zip_ref.extractall(tmp_extract_dir)
-
-        tasks = []
-        for root, _, files_in_dir in os.walk(tmp_extract_dir): # 更名为 files_in_dir 避免与函数参数 files 冲突
-            for filename in files_in_dir:
-                full_path = os.path.join(root, filename)
-                
-                if filename.startswith('.') or filename.endswith(('.DS_Store', 'LICENSE', 'README.md')):
-                    continue
-
-                if os.path.getsize(full_path) > 5 * 1024 * 1024: # 5MB
-                    results.append({
-                        "filename": filename,
-                        "language": "N/A",
-                        "static_check": "N/A",
-                        "gemini_review_markdown": "⚠️ 文件过大（>5MB），已跳过审查。",
-                    })
-                    continue
-
-                with open(full_path, "rb") as f:
-                    file_content = f.read()
-                
-                relative_filename = os.path.relpath(full_path, tmp_extract_dir)
-                
-                tasks.append(get_review_data(relative_filename, file_content))
-
-        results_from_zip = await asyncio.gather(*tasks) # 避免与外部 results 列表混淆
+        entries, oversized = await run_in_threadpool(_read_zip_entries, tmp_zip_path)
+        for filename in oversized:
+            results.append({
+                "filename": filename,
+                "language": "N/A",
+                "static_check": "N/A",
+                "gemini_review_markdown": "⚠️ 文件过大（>5MB），已跳过审查。",
+            })
+
+        # 批量 linter 需要真实路径，只为其支持的语言落盘
+        tmp_lint_dir = tempfile.mkdtemp()
+        rel_to_name, lint_failed = await run_in_threadpool(_write_lint_tree, tmp_lint_dir, entries)
+
+        order = {name: i for i, (name, _) in enumerate(entries)}
+
+        # 内容（及扩展名）完全相同的文件只审查一次，结果再分发给所有同内容文件
+        unique = {}
+        aliases = {}
+        for name, content in entries:
+            key = (os.path.splitext(name)[1].lower(), hashlib.blake2b(content, digest_size=16).digest())
+            if key in unique:
+                aliases[unique[key][0]].append(name)
+            else:
+                unique[key] = (name, content)
+                aliases[name] = [name]
+        unique_entries = list(unique.values())
+
+        small_files = [(name, content) for name, content in unique_entries if len(content) <= SMALL_FILE_BYTES]
+        tasks = [
+            get_review_data(name, content, run_static=False)
+            for name, content in unique_entries
+            if len(content) > SMALL_FILE_BYTES
+        ]
+
+        results_from_zip, small_results, lint_checks = await asyncio.gather( # 避免与外部 results 列表混淆
+            asyncio.gather(*tasks),
+            _review_small_files(small_files),
+            run_batch_static_analysis(tmp_lint_dir, list(rel_to_name)),
+        )
+        # 暂存到独立子目录的文件，在输出中换回 ZIP 内的原始路径
+        static_checks = {
+            rel_to_name[rel]: check if rel == rel_to_name[rel] else check.replace(rel, rel_to_name[rel])
+            for rel, check in lint_checks.items()
+        }
+        static_checks.update(lint_failed)
+        results_from_zip = sorted(
+            ({**res, "filename": alias} for res in results_from_zip + small_results for alias in aliases[res["filename"]]),
+            key=lambda r: order[r["filename"]]
+        )
+        for res in results_from_zip:
+            if res["static_check"] is None:
+                res["static_check"] = static_checks.get(res["filename"], "N/A (静态检查未对此语言配置)")
 
         formatted_results = []
         for res in results_from_zip: # 处理 zip 文件内的审查结果
@@ -223,7 +804,7 @@ async def review_zip(file: UploadFile = File(...)):
             
         results.extend(formatted_results) # 将 zip 文件内的结果合并到最终 results 列表中
             
-        return JSONResponse({"results": results})
+        return results
 
     except zipfile.BadZipFile:
         raise HTTPException(
@@ -233,79 +814,101 @@ async def review_zip(file: UploadFile = File(...)):
     finally:
         if tmp_zip_path and os.path.exists(tmp_zip_path):
             os.unlink(tmp_zip_path)
-        if tmp_extract_dir and os.path.isdir(tmp_extract_dir):
-            shutil.rmtree(tmp_extract_dir)
+        if tmp_lint_dir and os.path.isdir(tmp_lint_dir):
+            shutil.rmtree(tmp_lint_dir)
 
 
-@app.post("/review/zip/pretty", response_class=HTMLResponse, summary="获取 ZIP 压缩包内所有文件的 HTML 审查报告")
-async def review_zip_pretty_ui(file: UploadFile = File(...)):
+@app.post("/review/zip", summary="获取 ZIP 压缩包内所有文件的 JSON 审查结果")
+async def review_zip(file: UploadFile = File(...)):
     """
-    上传 ZIP 文件，返回一个排版优美的 HTML 页面报告，包含所有文件的审查结果。
+    上传 ZIP 文件，返回包内所有代码文件的审查报告列表。
     """
-    # 直接调用 review_zip 获取 JSON 数据
-    response = await review_zip(file)
-    data_json = json.loads(response.body.decode('utf-8')) # 直接从 response.body 解码
+    return JSONResponse({"results": await _review_zip_impl(file)})
 
-    all_reviews_html = ""
-    
-    for result in data_json.get("results", []):
-        filename = result.get('filename', 'N/A')
-        language = result.get('language', 'N/A')
-        gemini_md = result.get('gemini_review', '')
-        static_check = result.get('static_check', '')
-        
-        gemini_html = markdown2.markdown(
-            gemini_md,
-            extras=["fenced-code-blocks", "tables", "cuddled-lists"]
-        )
-        static_check_html = f"<pre><code>{static_check}</code></pre>"
-        
-        all_reviews_html += f"""
-        <div class="file-section">
-            <h2 class="file-header">📁 文件: {filename} ({language})</h2>
-            <div class="section">
-                <h2>🤖 Gemini 智能审查</h2>
-                <div class="gemini-review">
-                    {gemini_html}
-                </div>
-            </div>
-            <div class="section">
-                <h2>🔬 静态分析 (Linter)</h2>
-                {static_check_html}
-            </div>
-        </div>
-        <hr style="border: 0; border-top: 1px dashed #ccc; margin: 30px 0;">
-        """
 
-    html_content = f"""
+@functools.lru_cache(maxsize=1024)
+def _render_markdown(text: str) -> str:
+    """
+    将 Gemini 返回的 Markdown 渲染为 HTML，相同内容直接命中缓存。
+    """
+    return markdown2.markdown(
+        text,
+        extras=["fenced-code-blocks", "tables", "cuddled-lists"],
+        safe_mode="escape"
+    )
+
+# 报告页模板：模块加载时编译一次，开启自动转义，仅 gemini_html（markdown2 渲染结果）标记为 safe
+_jinja_env = jinja2.Environment(autoescape=True)
+ZIP_REPORT_TEMPLATE = _jinja_env.from_string("""
     <html>
     <head>
         <title>ZIP Code Review 报告</title>
         <style>
-            body {{ font-family: -apple-system, BlinkMacSystemFont, "Segoe UI", Roboto, "Helvetica Neue", Arial, sans-serif; line-height: 1.6; background-color: #f7f7f7; color: #333; margin: 0; padding: 20px; }}
-            .container {{ max-width: 900px; margin: 20px auto; background-color: #ffffff; border: 1px solid #e0e0e0; border-radius: 8px; box-shadow: 0 4px 12px rgba(0,0,0,0.05); overflow: hidden; }}
-            .header {{ padding: 20px 30px; border-bottom: 2px solid #eee; }}
-            .content {{ padding: 30px; }}
-            .section h2 {{ font-size: 1.5em; color: #007aff; border-bottom: 2px solid #f0f0f0; padding-bottom: 5px; }}
-            .file-header {{ font-size: 1.8em; color: #1a1a1a; margin-top: 40px; padding-bottom: 5px; border-bottom: 3px solid #007aff; }}
-            pre {{ background-color: #282c34; color: #abb2bf; padding: 15px; border-radius: 6px; overflow-x: auto; white-space: pre-wrap; word-wrap: break-word; }}
-            .gemini-review h3 {{ color: #333; }}
-            .gemini-review code:not(pre > code) {{ background-color: #f0f0f0; color: #c7254e; padding: 2px 4px; border-radius: 4px; font-family: monospace; }}
+            body { font-family: -apple-system, BlinkMacSystemFont, "Segoe UI", Roboto, "Helvetica Neue", Arial, sans-serif; line-height: 1.6; background-color: #f7f7f7; color: #333; margin: 0; padding: 20px; }
+            .container { max-width: 900px; margin: 20px auto; background-color: #ffffff; border: 1px solid #e0e0e0; border-radius: 8px; box-shadow: 0 4px 12px rgba(0,0,0,0.05); overflow: hidden; }
+            .header { padding: 20px 30px; border-bottom: 2px solid #eee; }
+            .content { padding: 30px; }
+            .section h2 { font-size: 1.5em; color: #007aff; border-bottom: 2px solid #f0f0f0; padding-bottom: 5px; }
+            .file-header { font-size: 1.8em; color: #1a1a1a; margin-top: 40px; padding-bottom: 5px; border-bottom: 3px solid #007aff; }
+            pre { background-color: #282c34; color: #abb2bf; padding: 15px; border-radius: 6px; overflow-x: auto; white-space: pre-wrap; word-wrap: break-word; }
+            .gemini-review h3 { color: #333; }
+            .gemini-review code:not(pre > code) { background-color: #f0f0f0; color: #c7254e; padding: 2px 4px; border-radius: 4px; font-family: monospace; }
         </style>
     </head>
     <body>
         <div class="container">
             <div class="header">
                 <h1>ZIP 压缩包 Code Review 报告</h1>
-                <p>包含 {len(data_json.get("results", []))} 个文件的审查结果。</p>
+                <p>包含 {{ results|length }} 个文件的审查结果。</p>
             </div>
             <div class="content">
-                {all_reviews_html}
+                {% for r in results %}
+                <div class="file-section">
+                    <h2 class="file-header">📁 文件: {{ r.filename }} ({{ r.language }})</h2>
+                    <div class="section">
+                        <h2>🤖 Gemini 智能审查</h2>
+                        <div class="gemini-review">
+                            {{ r.gemini_html|safe }}
+                        </div>
+                    </div>
+                    <div class="section">
+                        <h2>🔬 静态分析 (Linter)</h2>
+                        <pre><code>{{ r.static_check }}</code></pre>
+                    </div>
+                </div>
+                <hr style="border: 0; border-top: 1px dashed #ccc; margin: 30px 0;">
+                {% endfor %}
             </div>
         </div>
     </body>
     </html>
+""")
+
+
+@app.post("/review/zip/pretty", response_class=HTMLResponse, summary="获取 ZIP 压缩包内所有文件的 HTML 审查报告")
+async def review_zip_pretty_ui(file: UploadFile = File(...)):
     """
+    上传 ZIP 文件，返回一个排版优美的 HTML 页面报告，包含所有文件的审查结果。
+    """
+    # 直接获取审查结果列表，无需经过 JSON 编解码
+    results = await _review_zip_impl(file)
+
+    # Markdown 渲染放入线程池并发执行，避免阻塞事件循环
+    gemini_htmls = await asyncio.gather(*(
+        run_in_threadpool(_render_markdown, result.get('gemini_review', ''))
+        for result in results
+    ))
+
+    rendered = []
+    for result, gemini_html in zip(results, gemini_htmls):
+        rendered.append({
+            "filename": result.get('filename', 'N/A'),
+            "language": result.get('language', 'N/A'),
+            "static_check": result.get('static_check', ''),
+            "gemini_html": gemini_html,
+        })
+
+    html_content = ZIP_REPORT_TEMPLATE.render(results=rendered)
     return HTMLResponse(content=html_content)
 
 